@@ -0,0 +1,181 @@
+#!/usr/bin/python3 -u
+# -*-coding:Utf-8 -*
+#
+# Backfill of rawlog
+# ~~~~~~~~~~~~~~~~~~
+#
+# Telegrams unknown to the decoder are stored in the table rawlog. When the meaning
+# of an address becomes known and is added to logamaticdecoder.Decode (and a column
+# to the archive table), this script decodes the historical telegrams from rawlog
+# and writes them into the archive table:
+#   - rawlog is read with a server side cursor in chunks, in the order it was logged
+#   - every telegram is run through the current decoder
+#   - the archive table holds a snapshot of the full state every minute (see
+#     put_to_archive.php), and the KM271 only sends a value when it changes. So a value
+#     is carried forward: it is written into every snapshot taken after the telegram,
+#     up to and including the snapshot at the time of the next telegram with the same
+#     value. After the last telegram, only snapshots where the column is still NULL are
+#     filled, later snapshots were written by the daemon itself.
+#   - no archive rows are inserted, telegrams without a later snapshot are not stored
+#   - decoded rows are marked as decoded with batched UPDATEs, in the same transaction
+#     as the archive rows that carry their value
+#
+# Rows already decoded are read as well, they end the interval of the telegram before
+# them but are not written again. Rows which are still unknown to the decoder stay
+# undecoded, so an interrupted backfill simply continues with the rows not yet decoded,
+# and rows of any age are picked up again once the decoder knows them. With --rate and
+# --pause, the load on the database can be limited, so the daemon is not disturbed
+# while backfilling millions of rows.
+#
+# Example:
+#   python3 backfill.py --address 88 2e --rate 500
+#
+# License: CC-BY-SA 3.0
+
+import argparse
+import contextlib
+import os
+import time as t
+
+import pymysql
+
+from logamatic import logamaticdecoder
+
+COLUMNS = ", ".join("telegram_byte%d" % i for i in range(1,11))
+
+
+# Decoder which collects the decoded values instead of writing them to current_state
+class backfilldecoder (logamaticdecoder):
+
+    def __init__ (self):
+        self.values = []
+
+    def StateToDB (self,typeOfValue,value):
+        self.values.append((typeOfValue,value))
+
+    def LogToDB (self,telegram):
+        pass
+
+    # Decode a telegram, returns a list of (column, value)
+    def Collect (self,telegram):
+        self.values = []
+        self.Decode(telegram)
+        return self.values
+
+
+# Telegram from a row of rawlog (length, telegram_byte1, ..., telegram_byte10)
+def rawtelegram (row):
+    length = min(row[0],10)
+    return bytes(b & 0xFF for b in row[1:1 + length] if b is not None)
+
+
+# The interval of the pending telegram of column ends at until (None: no next telegram)
+# pending maps the column to (logtime, value, id) of the last telegram not yet written.
+# The id is marked as decoded once none of its columns is pending any more.
+def flush (pending,column,until,updates,decoded):
+    logtime, value, rowid = pending.pop(column)
+    updates.append((column,value,logtime,until))
+    if all(other[2] != rowid for other in pending.values()):
+        decoded.append(rowid)
+
+
+# Write one chunk: values carried forward into the archive snapshots and decoded flags,
+# in one transaction. updates is a list of (column, value, logtime, until).
+def writechunk (db,updates,decoded):
+    cursor = db.cursor()
+    try:
+        bounded = {}
+        unbounded = {}
+        for column, value, logtime, until in updates:
+            if until is None:
+                unbounded.setdefault(column,[]).append((value,logtime))
+            else:
+                bounded.setdefault(column,[]).append((value,logtime,until))
+        # uses the index iTIME
+        for column, rows in bounded.items():
+            cursor.executemany("UPDATE archive SET " + column + " = %s WHERE `time` > %s AND `time` <= %s",rows)
+        for column, rows in unbounded.items():
+            cursor.executemany("UPDATE archive SET " + column + " = %s WHERE `time` > %s AND " + column + " IS NULL",rows)
+        if decoded:
+            cursor.execute("UPDATE rawlog SET decoded = 1 WHERE id IN (" + ", ".join(["%s"]*len(decoded)) + ")",decoded)
+        db.commit()
+    except:
+        db.rollback()
+        raise
+
+
+def main ():
+    parser = argparse.ArgumentParser(description="Decode rawlog telegrams with the current decoder and write them into the archive table")
+    parser.add_argument("--address",nargs=2,metavar=("BYTE1","BYTE2"),help="only telegrams with this address (hex), e.g. 88 2e")
+    parser.add_argument("--chunk",type=int,default=1000,help="rows per chunk")
+    parser.add_argument("--rate",type=float,default=0,help="maximum rows per second (default: unlimited)")
+    parser.add_argument("--pause",type=float,default=0.1,help="pause after every chunk in seconds")
+    parser.add_argument("--dry-run",action="store_true",help="only decode and count, do not write")
+    args = parser.parse_args()
+
+    decoder = backfilldecoder()
+    sql = "SELECT id, logtime, decoded, length, " + COLUMNS + " FROM rawlog"
+    params = []
+    if args.address:
+        # uses the index kAddress
+        sql += " WHERE telegram_byte1 = %s AND telegram_byte2 = %s"
+        params += [int(args.address[0],16),int(args.address[1],16)]
+    sql += " ORDER BY id"
+
+    # Reading and writing need separate connections, the server side cursor keeps
+    # its connection busy until all rows are read.
+    readdb = decoder.ConnectDB()
+    writedb = decoder.ConnectDB()
+    cursor = readdb.cursor(pymysql.cursors.SSCursor)
+    cursor.execute(sql,params)
+
+    pending = {}
+    total = 0
+    done = 0
+    start = t.monotonic()
+    try:
+        while True:
+            rows = cursor.fetchmany(args.chunk)
+            if not rows:
+                break
+            updates = []
+            decoded = []
+            with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+                for row in rows:
+                    result = decoder.Collect(rawtelegram(row[3:]))
+                    for column, value in result:
+                        if column in pending:
+                            flush(pending,column,row[1],updates,decoded)
+                        if not row[2]:
+                            pending[column] = (row[1],value,row[0])
+                    if result and not row[2]:
+                        done += 1
+            if not args.dry_run:
+                writechunk(writedb,updates,decoded)
+            total += len(rows)
+            elapsed = t.monotonic() - start
+            print("%d rows read, %d decoded, last id %d, %.0f rows/s" % (total,done,rows[-1][0],total/elapsed if elapsed else 0.0))
+
+            # Throttling
+            wait = args.pause
+            if args.rate:
+                wait = max(wait,total/args.rate - elapsed)
+            t.sleep(wait)
+
+        # The last telegram of every column is carried forward into the snapshots still empty
+        updates = []
+        decoded = []
+        for column in list(pending):
+            flush(pending,column,None,updates,decoded)
+        if not args.dry_run:
+            writechunk(writedb,updates,decoded)
+    finally:
+        cursor.close()
+        readdb.close()
+        writedb.close()
+
+    print("Finished:", total, "rows read,", done, "decoded" if not args.dry_run else "decodable (dry run)")
+
+
+if __name__ == "__main__":
+    main()
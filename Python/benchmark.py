@@ -0,0 +1,379 @@
+#!/usr/bin/python3 -u
+# -*-coding:Utf-8 -*
+#
+# Benchmark suite
+# ~~~~~~~~~~~~~~~
+#
+# Measures the hot paths of the software, so changes to the 3964R codec
+# (Dust3964r.crc, outframe, inframe, schritt_5) or to the decoder and the
+# persistence (logamaticdecoder.Decode, StateToDB, LogToDB) can be compared
+# between commits:
+#
+#   crc      BCC calculations per second
+#   codec    frames per second through outframe and inframe
+#   stream   frames per second through the receiving step schritt_5 (loop device)
+#   decode   telegrams per second through Decode, database calls discarded
+#   alloc    memory allocated per telegram by codec and decoder (tracemalloc)
+#   db       telegrams per second through Decode into a database
+#
+# The corpus is either generated (reproducible by --seed) or read from a file with
+# one recorded telegram per line in hex notation, e.g. "88 2b 3a".
+# The database used is a SQLite stand-in with the tables from the MySQL directory,
+# or, with --mysql, the MySQL database configured in logamatic.py. Attention: the
+# latter writes into the real tables current_state and rawlog.
+#
+# Results are written as JSON, by default into the temporary directory. With --compare, the results are compared to a
+# previously saved JSON file.
+#
+# Example:
+#   python3 benchmark.py --output before.json
+#   python3 benchmark.py --output after.json --compare before.json
+#
+# License: CC-BY-SA 3.0
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import subprocess
+import tempfile
+import time as t
+import tracemalloc
+
+import serial
+
+from c3964 import Dust3964r
+from stepchain import stepchain
+from logamatic import logamaticdecoder
+
+SQLDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "MySQL")
+KEEPALIVE = b"\x04\x00\x07\x01\x81\x0E\xC0\x04"
+
+
+# Synthetic corpus: status telegrams from the address ranges of the Logamatic
+# (including values containing DLE), some keep-alive and some unknown telegrams
+def synthetic (count,seed):
+    rnd = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        r = rnd.random()
+        if r < 0.1:
+            corpus.append(KEEPALIVE)
+        elif r < 0.15:
+            corpus.append(bytes(rnd.randrange(256) for i in range(rnd.randrange(4,11))))
+        else:
+            value = 0x10 if r < 0.2 else rnd.randrange(256)
+            corpus.append(bytes([rnd.choice((0x80,0x81,0x84,0x88,0x89)),rnd.randrange(0x40),value]))
+    return corpus
+
+
+# Recorded corpus: one telegram per line in hex notation
+def recorded (path):
+    corpus = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].replace("0x","").replace(",", " ").strip()
+            if line:
+                corpus.append(bytes.fromhex(line))
+    return corpus
+
+
+# 3964R driver without serial port, connected to a loop device for the stream benchmark
+def driver ():
+    d = Dust3964r.__new__(Dust3964r)
+    stepchain.__init__(d)
+    d.MODE = Dust3964r.M3964R
+    d.CFG_PRINT = False
+    d.SLP = 0
+    d.ZVZ = 3600.0
+    d.RS232 = serial.serial_for_url("loop://",timeout=0)
+    return d
+
+
+# Decoder which only counts the database calls
+class nulldecoder (logamaticdecoder):
+
+    def __init__ (self):
+        self.calls = 0
+
+    def StateToDB (self,typeOfValue,value):
+        self.calls += 1
+
+    def LogToDB (self,telegram):
+        self.calls += 1
+
+
+# Cursor of the SQLite stand-in, translates the MySQL specific upsert
+class sqlitecursor:
+
+    def __init__ (self,cursor):
+        self.cursor = cursor
+
+    def execute (self,sql):
+        return self.cursor.execute(sql.replace("ON DUPLICATE KEY UPDATE","ON CONFLICT(id) DO UPDATE SET"))
+
+
+# Connection of the SQLite stand-in, behaves like a pymysql connection for the decoder
+class sqliteconnection:
+
+    def __init__ (self,path):
+        self.db = sqlite3.connect(path)
+
+    def cursor (self):
+        return sqlitecursor(self.db.cursor())
+
+    def commit (self):
+        self.db.commit()
+
+    def rollback (self):
+        self.db.rollback()
+
+    def close (self):
+        self.db.close()
+
+
+# Decoder writing into the SQLite stand-in
+class sqlitedecoder (logamaticdecoder):
+
+    def __init__ (self,path):
+        self.path = path
+
+    def ConnectDB (self):
+        return sqliteconnection(self.path)
+
+
+# Create the tables from the MySQL directory in a SQLite database
+def sqliteschema (path):
+    db = sqlite3.connect(path)
+    for name in ("status_table.sql","archive_tables.sql"):
+        with open(os.path.join(SQLDIR,name)) as f:
+            sql = f.read()
+        for table, body in re.findall(r"CREATE TABLE `(\w+)` \((.*?)\) ENGINE",sql,re.S):
+            columns = []
+            for column, definition in re.findall(r"^\s*`(\w+)` (.*?),?$",body,re.M):
+                if column == "id":
+                    columns.append("id INTEGER PRIMARY KEY")
+                elif "CURRENT_TIMESTAMP" in definition:
+                    columns.append(column + " TEXT DEFAULT CURRENT_TIMESTAMP")
+                elif column == "decoded":
+                    columns.append(column + " INTEGER NOT NULL DEFAULT 0")
+                else:
+                    columns.append(column)
+            db.execute("CREATE TABLE " + table + " (" + ", ".join(columns) + ")")
+    db.commit()
+    db.close()
+
+
+# Run fn over the corpus repeat times and return the best rate in items per second
+def rate (fn,corpus,repeat):
+    best = None
+    for i in range(repeat):
+        start = t.perf_counter()
+        fn(corpus)
+        elapsed = t.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return {"items": len(corpus), "seconds": best, "per_second": len(corpus)/best}
+
+
+def bench_crc (corpus,repeat):
+    d = driver()
+    frames = [d.outframe(telegram)[:-1] for telegram in corpus]
+    def run (frames):
+        for frame in frames:
+            d.crc(frame)
+    return rate(run,frames,repeat)
+
+
+def bench_codec (corpus,repeat):
+    d = driver()
+    def run (corpus):
+        for telegram in corpus:
+            if d.inframe(d.outframe(telegram)) != telegram:
+                raise RuntimeError("codec roundtrip failed for " + telegram.hex())
+    return rate(run,corpus,repeat)
+
+
+def bench_stream (corpus,repeat):
+    d = driver()
+    received = []
+    d.ReadSuccess = received.append
+    frames = [d.outframe(telegram) for telegram in corpus]
+    def run (frames):
+        for frame in frames:
+            d.RS232.reset_input_buffer()
+            d.RS232.write(frame)
+            d.newstep = True
+            d.starttime = t.time()
+            d.schritt_5()
+    result = rate(run,frames,repeat)
+    if received[:len(corpus)] != corpus:
+        raise RuntimeError("stream decoder returned different telegrams")
+    d.RS232.close()
+    return result
+
+
+def bench_decode (corpus,repeat):
+    decoder = nulldecoder()
+    def run (corpus):
+        for telegram in corpus:
+            decoder.Decode(telegram)
+    with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+        result = rate(run,corpus,repeat)
+    result["db_calls_per_telegram"] = decoder.calls/(len(corpus)*repeat)
+    return result
+
+
+# Memory allocated per telegram
+# The peak is measured around every single telegram. Retained memory only counts
+# what has grown, memory freed elsewhere (e.g. by the warm up) must not cancel it out.
+def allocations (fn,corpus):
+    peaks = [0]*len(corpus)
+    tracemalloc.start()
+    try:
+        fn(corpus)                      # warm up caches and interned objects
+        before = tracemalloc.take_snapshot()
+        for i, telegram in enumerate(corpus):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn((telegram,))
+            peaks[i] = tracemalloc.get_traced_memory()[1] - base
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    # Allocations of this function itself (the peak values) are not counted
+    own = [tracemalloc.Filter(False,__file__)]
+    growth = [stat for stat in after.filter_traces(own).compare_to(before.filter_traces(own),"lineno") if stat.count_diff > 0]
+    return {
+        "peak_bytes_per_telegram": sum(peaks)/len(corpus),
+        "peak_bytes_max": max(peaks),
+        "retained_bytes_per_telegram": sum(stat.size_diff for stat in growth)/len(corpus),
+        "retained_blocks_per_telegram": sum(stat.count_diff for stat in growth)/len(corpus),
+    }
+
+
+def bench_alloc (corpus,repeat):
+    d = driver()
+    decoder = nulldecoder()
+    def codec (corpus):
+        for telegram in corpus:
+            d.inframe(d.outframe(telegram))
+    def decode (corpus):
+        for telegram in corpus:
+            decoder.Decode(telegram)
+    with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+        return {"codec": allocations(codec,corpus), "decode": allocations(decode,corpus)}
+
+
+def bench_db (corpus,repeat,mysql=False):
+    if mysql:
+        decoder = logamaticdecoder()
+        tmp = None
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name,"logamatic.sqlite")
+        sqliteschema(path)
+        decoder = sqlitedecoder(path)
+    def run (corpus):
+        for telegram in corpus:
+            decoder.Decode(telegram)
+    try:
+        with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+            result = rate(run,corpus,repeat)
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+    result["database"] = "mysql" if mysql else "sqlite"
+    return result
+
+
+BENCHMARKS = {
+    "crc": bench_crc,
+    "codec": bench_codec,
+    "stream": bench_stream,
+    "decode": bench_decode,
+    "alloc": bench_alloc,
+    "db": bench_db,
+}
+
+
+def commit ():
+    try:
+        return subprocess.run(["git","rev-parse","--short","HEAD"],capture_output=True,text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Print relative changes of all numeric results compared to an older result file
+def compare (old,new):
+    def walk (prefix,a,b):
+        for key in sorted(b):
+            if key not in a:
+                continue
+            if isinstance(b[key],dict):
+                walk(prefix + key + ".",a[key],b[key])
+            elif isinstance(b[key],(int,float)) and not isinstance(b[key],bool) and a[key]:
+                change = (b[key] - a[key])/a[key]*100
+                print("%-50s %14.2f %14.2f %+8.1f%%" % (prefix + key,a[key],b[key],change))
+    print("%-50s %14s %14s %9s" % ("Compared to " + str(old.get("commit")),"old","new","change"))
+    walk("",old["results"],new["results"])
+
+
+def main ():
+    parser = argparse.ArgumentParser(description="Benchmarks for the 3964R codec, the decoder and the database access")
+    parser.add_argument("benchmarks",nargs="*",help="benchmarks to run: " + ", ".join(BENCHMARKS) + " (default: all)")
+    parser.add_argument("--corpus",help="recorded corpus, one telegram per line in hex notation")
+    parser.add_argument("--count",type=int,default=20000,help="size of the synthetic corpus")
+    parser.add_argument("--seed",type=int,default=2107,help="seed of the synthetic corpus")
+    parser.add_argument("--repeat",type=int,default=5,help="number of runs, the best one counts")
+    parser.add_argument("--dbcount",type=int,default=500,help="telegrams used for the database benchmark")
+    parser.add_argument("--mysql",action="store_true",help="use the MySQL database configured in logamatic.py instead of SQLite")
+    parser.add_argument("--output",default=os.path.join(tempfile.gettempdir(),"logamatic-benchmark.json"),help="file for the results (default: %(default)s)")
+    parser.add_argument("--compare",help="result file of an earlier run to compare with")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark " + name)
+
+    if args.corpus:
+        corpus = recorded(args.corpus)
+        source = {"type": "recorded", "file": os.path.basename(args.corpus)}
+    else:
+        corpus = synthetic(args.count,args.seed)
+        source = {"type": "synthetic", "count": args.count, "seed": args.seed}
+
+    results = {}
+    for name in args.benchmarks or BENCHMARKS:
+        print("Running", name, "...", end=" ", flush=True)
+        if name == "db":
+            results[name] = bench_db(corpus[:args.dbcount],1,args.mysql)
+        else:
+            results[name] = BENCHMARKS[name](corpus,args.repeat)
+        print(json.dumps(results[name]))
+
+    report = {
+        "commit": commit(),
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "corpus": source,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output,"w") as f:
+        json.dump(report,f,indent=2)
+    print("Results written to", args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f),report)
+
+
+if __name__ == "__main__":
+    main()
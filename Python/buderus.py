@@ -4,14 +4,29 @@
 # ~~~~~~~~~~
 #
 # This script mainly serves as a "container" for the logamatic2107 class.
+# With the option --split, the serial protocol and the database access run in
+# two separate processes (see logamatic.py).
+# The daemon can be profiled while running via the signals SIGUSR1 and SIGUSR2 (see
+# profiling.py). With the option --sampling, SIGUSR2 starts the sampling profiler
+# instead of cProfile.
+# With the option --adaptive, the 3964R waiting times are adapted to the measured
+# response times of the Logamatic (see c3964.py).
 #
 # License: CC-BY-SA 3.0
 # Author: Sebastian Suchanek
 
-from logamatic import logamatic2107
+import sys
+import profiling
+from logamatic import logamatic2107, runsplit
 
 print("Starting daemon")
 
 ende = False
-a = logamatic2107()
-a.run()
+sampling = "--sampling" in sys.argv
+adaptive = "--adaptive" in sys.argv
+if "--split" in sys.argv:
+    runsplit(sampling,adaptive)
+else:
+    a = logamatic2107(adaptive)
+    profiling.install(a,sampling)
+    a.run()
@@ -0,0 +1,385 @@
+#!/usr/bin/python3 -u
+# -*-coding:Utf-8 -*
+#
+# Bulk decoder for raw 3964R captures
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Offline tool for decoding large dumps of the raw byte stream sent by the KM271
+# module, e.g. for reverse engineering of telegrams which are not evaluated by
+# logamatic2107 (heating circuit 2, "Kesselintegral", ...).
+#
+# The dump is memory mapped and processed in chunks with vectorized NumPy operations
+# instead of feeding it byte by byte through Dust3964r.schritt_5:
+#   - find the frames: STX, data with doubled DLE, DLE ETX as end mark, BCC
+#   - validate the BCC
+#   - undo the DLE doubling
+#   - output a structured array with offset, time, address, value and telegram
+#   - per address statistics
+#
+# The frames found are the same as the ones found by the receiving steps of Dust3964r:
+# after a frame (or at the beginning), everything up to the next STX is ignored, and
+# a frame ends with the first DLE ETX whose DLE is not a doubled one. With --verify,
+# the result is compared to a byte by byte decoder working like schritt_0/schritt_5.
+# Timeouts (ZVZ) and the flushing of the input buffer can not be seen in a dump and
+# are not taken into account.
+#
+# A raw dump does not contain time stamps, so the time of the frames is NaN (not
+# available). If the capture was recorded with time stamps, they can be given with
+# --times as a text file with one "<byte offset> <time>" line per time stamp, the time
+# as ISO date/time or Unix time, offsets ascending. A frame gets the time of the last
+# time stamp at or before its STX.
+#
+# Example:
+#   python3 bulkdecode.py capture.bin --times capture.times --output frames.npy
+#
+# License: CC-BY-SA 3.0
+
+import argparse
+import contextlib
+import datetime
+import os
+import struct
+import time as t
+
+import numpy as np
+
+STX = 0x02
+ETX = 0x03
+DLE = 0x10
+
+MAXTELEGRAM = 10        # bytes of a telegram stored in the output, like table rawlog
+CHUNK = 8               # default chunk size in MiB
+
+FRAME = np.dtype([
+    ("offset", "<i8"),                      # byte offset of the STX in the dump
+    ("time", "<f8"),                        # Unix time of the frame, NaN if not available
+    ("length", "<u2"),                      # length of the telegram
+    ("valid", "?"),                         # BCC correct
+    ("address", "<u2"),                     # first two bytes of the telegram
+    ("value", "<i2"),                       # third byte of 3 byte telegrams, else -1
+    ("telegram", "u1", (MAXTELEGRAM,)),     # telegram, DLE doubling removed
+])
+
+
+# Decode one chunk of the dump
+# Returns the frames found and the position (relative to the chunk) where the next
+# chunk has to start. If final is False, an incomplete frame at the end of the chunk
+# is left for the next chunk.
+def decodechunk (data,final):
+    n = len(data)
+    empty = np.zeros(0,FRAME)
+    isstx = data == STX
+    if not isstx.any():
+        return empty, n
+
+    # DLE doubling: within a sequence of DLEs, every second one is a doubled DLE
+    dle = np.flatnonzero(data == DLE)
+    newrun = np.ones(len(dle),dtype=bool)
+    newrun[1:] = dle[1:] != dle[:-1] + 1
+    runstart = dle[newrun][np.cumsum(newrun) - 1]
+    dd = dle[((dle - runstart) & 1) == 1]
+    doubled = np.zeros(n + 2*MAXTELEGRAM + 1,dtype=bool)     # padded like the telegram windows
+    doubled[dd] = True
+
+    # End marks: ETX directly after a DLE which is not a doubled one, followed by the BCC
+    etx = np.flatnonzero(data[1:n - 1] == ETX) + 1
+    etx = etx[(data[etx - 1] == DLE) & ~doubled[etx - 1]]
+
+    # For every STX: position of the BCC of the frame it would start, and the next
+    # STX after that frame. With STX and end marks in the order of the dump, the number
+    # of end marks before an STX is its index minus the number of STX before it.
+    event = isstx.copy()
+    event[etx] = True
+    event = np.flatnonzero(event)
+    kind = isstx[event]
+    stx = event[kind]
+    ei = np.flatnonzero(kind) - np.arange(len(stx))
+    complete = ei < len(etx)
+    bcc = np.append(etx + 1,n)[ei]
+    # An STX as BCC does not start a frame
+    before = np.flatnonzero(~kind) - np.arange(len(etx))
+    nxt = np.append(before + isstx[etx + 1],len(stx))[ei]
+
+    # The first STX starts a frame, and every frame start leads to the next one.
+    # Reduce the set of all STX to the ones reachable from the first one; STX within
+    # a frame drop out because nothing leads to them.
+    chain = np.arange(len(stx))
+    while True:
+        follow = nxt[chain]
+        follow = follow[follow < len(stx)]
+        if len(follow):
+            follow = follow[np.r_[True,follow[1:] != follow[:-1]]]
+        reached = np.concatenate(([0],follow))
+        if len(reached) == len(chain):
+            break
+        chain = reached
+
+    # Incomplete frame at the end of the chunk
+    if complete[chain[-1]]:
+        restart = bcc[chain[-1]] + 1
+    else:
+        restart = n if final else stx[chain[-1]]
+        chain = chain[:-1]
+    if len(chain) == 0:
+        return empty, restart
+
+    start = stx[chain]
+    end = bcc[chain]
+
+    # BCC: XOR over everything between STX and BCC, from the running XOR of the chunk
+    xor = np.bitwise_xor.accumulate(data)
+    valid = (xor[end - 1] ^ xor[start]) == data[end]
+
+    # Telegram: bytes between STX and the DLE ETX end mark without the doubled DLEs
+    raw = end - start - 3
+    frame = np.searchsorted(start,dd,side="right") - 1
+    inside = frame >= 0
+    inside[inside] = dd[inside] < end[frame[inside]] - 2
+    length = raw - np.bincount(frame[inside],minlength=len(start))
+
+    # The first bytes of every telegram are copied as a fixed size window after the
+    # STX and cut to the length. Only in the few telegrams with doubled DLEs, the
+    # window is twice as large and the doubled DLEs are moved to the end of it.
+    padded = np.concatenate((data,np.zeros(2*MAXTELEGRAM + 1,np.uint8)))
+    window = np.lib.stride_tricks.sliding_window_view(padded,2*MAXTELEGRAM)
+    telegram = window[start + 1,:MAXTELEGRAM]
+    fix = np.flatnonzero(length < raw)
+    if len(fix):
+        window = window[start[fix] + 1]
+        drop = np.lib.stride_tricks.sliding_window_view(doubled,2*MAXTELEGRAM)[start[fix] + 1]
+        order = np.argsort(drop,axis=1,kind="stable")[:,:MAXTELEGRAM]
+        telegram[fix] = np.take_along_axis(window,order,axis=1)
+    # Bytes after the end of the telegram are cleared with one mask row per length
+    column = np.arange(MAXTELEGRAM)
+    mask = np.where(column < np.arange(MAXTELEGRAM + 1)[:,None],0xff,0).astype(np.uint8)
+    telegram &= mask.take(np.minimum(length,MAXTELEGRAM),axis=0)
+
+    out = np.zeros(len(start),FRAME)
+    out["offset"] = start
+    out["length"] = length
+    out["valid"] = valid
+    out["telegram"] = telegram
+    tel = telegram.astype(np.uint16)
+    out["address"] = np.where(length >= 2,(tel[:,0] << 8) | tel[:,1],0)
+    out["value"] = np.where(length == 3,tel[:,2],-1)
+    return out, restart
+
+
+# Time stamps of a capture: "<byte offset> <time>" per line
+# Returns the offsets and the Unix times as arrays.
+def loadtimes (path):
+    offsets = []
+    times = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].split()
+            if not line:
+                continue
+            offsets.append(int(line[0]))
+            try:
+                times.append(float(line[1]))
+            except ValueError:
+                times.append(datetime.datetime.fromisoformat(line[1]).timestamp())
+    offsets = np.array(offsets,np.int64)
+    if np.any(np.diff(offsets) < 0):
+        raise ValueError("offsets in " + path + " are not ascending")
+    return offsets, np.array(times,np.float64)
+
+
+# Decode a whole dump, yields the frames chunk by chunk
+# times are the time stamps from loadtimes, without them the time of the frames is NaN.
+def decodefile (path,times=None,chunk=CHUNK):
+    data = np.memmap(path,dtype=np.uint8,mode="r") if os.path.getsize(path) else np.zeros(0,np.uint8)
+    size = int(chunk*1024*1024)
+    pos = 0
+    while pos < len(data):
+        final = pos + size >= len(data)
+        frames, restart = decodechunk(np.asarray(data[pos:pos + size]),final)
+        if restart == 0 and not final:
+            # Frame larger than the chunk, try again with a larger one
+            size *= 2
+            continue
+        frames["offset"] += pos
+        if times is None or not len(times[0]):
+            frames["time"] = np.nan
+        else:
+            # Frames before the first time stamp have no time
+            index = np.searchsorted(times[0],frames["offset"],side="right") - 1
+            frames["time"] = np.where(index >= 0,times[1][np.maximum(index,0)],np.nan)
+        pos += int(restart)
+        size = int(chunk*1024*1024)
+        yield frames
+
+
+# Reference: byte by byte like the receiving steps of Dust3964r
+# Returns a list of (offset, telegram) with telegram None if the BCC was wrong
+def streamdecode (path):
+    from c3964 import Dust3964r
+    d = Dust3964r.__new__(Dust3964r)
+    d.MODE = Dust3964r.M3964R
+    with open(path,"rb") as f:
+        data = f.read()
+    result = []
+    receiving = False
+    for offset, c in enumerate(data):
+        if not receiving:
+            # schritt_0: only STX starts a frame
+            if c == STX:
+                receiving = True
+                begin = offset
+                readbuff = b""
+                STX_EN = False
+                BCC_EN = False
+            continue
+        # schritt_5
+        readbuff += bytes([c])
+        if BCC_EN:
+            result.append((begin,d.inframe(readbuff)))
+            receiving = False
+        elif c == DLE:
+            STX_EN = not STX_EN
+        elif c == ETX and STX_EN:
+            BCC_EN = True
+        else:
+            STX_EN = False
+            BCC_EN = False
+    return result
+
+
+# Compare the frames with the result of the byte by byte decoder
+def verify (path,frames):
+    reference = streamdecode(path)
+    if len(reference) != len(frames):
+        print("Verify: number of frames differs:", len(reference), "byte by byte,", len(frames), "bulk")
+        return False
+    for (offset, telegram), frame in zip(reference,frames):
+        bulk = bytes(frame["telegram"][:min(frame["length"],MAXTELEGRAM)]) if frame["valid"] else None
+        if telegram is not None:
+            telegram = telegram[:MAXTELEGRAM]
+        if offset != frame["offset"] or telegram != bulk:
+            print("Verify: frame at offset", offset, "differs")
+            return False
+    print("Verify: all", len(frames), "frames identical")
+    return True
+
+
+# Per address statistics of all valid 3 byte telegrams
+class addressstats:
+
+    def __init__ (self):
+        self.count = np.zeros(65536,np.int64)
+        self.total = np.zeros(65536,np.int64)
+        self.seen = np.zeros(65536*256,bool)      # values seen per address, for minimum and maximum
+        self.other = np.zeros(65536,np.int64)     # valid telegrams of other lengths
+
+    def add (self,frames):
+        valid = frames["valid"]
+        length = frames["length"]
+        data = valid & (length == 3)
+        address = frames["address"][data]
+        value = frames["value"][data]
+        self.count += np.bincount(address,minlength=65536)
+        self.total += np.bincount(address,weights=value,minlength=65536).astype(np.int64)
+        self.seen[(address.astype(np.int64) << 8) | value] = True
+        self.other += np.bincount(frames["address"][valid & (length != 3) & (length >= 2)],minlength=65536)
+
+    def show (self):
+        seen = self.seen.reshape(65536,256)
+        minimum = np.argmax(seen,axis=1)
+        maximum = 255 - np.argmax(seen[:,::-1],axis=1)
+        names = addressnames(np.flatnonzero(self.count))
+        print("%-9s %-24s %10s %5s %5s %7s %10s" % ("Address","Column","Count","Min","Max","Mean","Other"))
+        for address in np.flatnonzero(self.count + self.other):
+            count = self.count[address]
+            print("%02x %02x     %-24s %10d %5s %5s %7s %10d" % (address >> 8,address & 255,names.get(address,""),count,
+                  minimum[address] if count else "",maximum[address] if count else "",
+                  "%.1f" % (self.total[address]/count) if count else "",self.other[address]))
+
+
+# Column names of the addresses, as evaluated by the current decoder of logamatic2107
+# "(ignored)" marks addresses known to the decoder but not stored.
+def addressnames (addresses):
+    from logamatic import logamaticdecoder
+
+    class namedecoder (logamaticdecoder):
+        def StateToDB (self,typeOfValue,value):
+            self.name = typeOfValue
+        def LogToDB (self,telegram):
+            self.name = ""
+
+    decoder = namedecoder()
+    names = {}
+    with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+        for address in addresses:
+            decoder.name = "(ignored)"
+            decoder.Decode(bytes([address >> 8,address & 255,0]))
+            names[address] = decoder.name
+    return names
+
+
+# Writes a .npy file chunk by chunk, the header is completed at the end
+class npywriter:
+
+    HEADER = 128
+
+    def __init__ (self,path):
+        self.file = open(path,"wb")
+        self.count = 0
+        self.file.write(self.header())
+
+    def header (self):
+        text = repr({"descr": np.lib.format.dtype_to_descr(FRAME),"fortran_order": False,"shape": (self.count,)}).encode("latin1")
+        size = (12 + len(text) + 1 + self.HEADER + 63)//64*64
+        return b"\x93NUMPY\x02\x00" + struct.pack("<I",size - 12) + text.ljust(size - 13) + b"\n"
+
+    def write (self,frames):
+        frames.tofile(self.file)
+        self.count += len(frames)
+
+    def close (self):
+        self.file.seek(0)
+        self.file.write(self.header())
+        self.file.close()
+
+
+def main ():
+    parser = argparse.ArgumentParser(description="Bulk decoder for raw 3964R captures of the KM271")
+    parser.add_argument("dump",help="file with the raw byte stream")
+    parser.add_argument("--output",help="write the frames to this .npy file")
+    parser.add_argument("--times",help="time stamps of the capture, one \"<byte offset> <time>\" per line (default: no times)")
+    parser.add_argument("--chunk",type=int,default=CHUNK,help="chunk size in MiB")
+    parser.add_argument("--verify",action="store_true",help="compare with a byte by byte decoder (slow)")
+    parser.add_argument("--nostats",action="store_true",help="do not print the per address statistics")
+    args = parser.parse_args()
+
+    times = loadtimes(args.times) if args.times else None
+    writer = npywriter(args.output) if args.output else None
+    stats = addressstats()
+    collected = []
+    frames = 0
+    valid = 0
+    begin = t.perf_counter()
+    for chunk in decodefile(args.dump,times,args.chunk):
+        frames += len(chunk)
+        valid += int(chunk["valid"].sum())
+        stats.add(chunk)
+        if writer:
+            writer.write(chunk)
+        if args.verify:
+            collected.append(chunk)
+    elapsed = t.perf_counter() - begin
+    if writer:
+        writer.close()
+
+    size = os.path.getsize(args.dump)
+    print("%d bytes in %.2f s (%.1f MiB/s): %d frames, %d valid, %d with wrong BCC" %
+          (size,elapsed,size/1048576/elapsed if elapsed else 0.0,frames,valid,frames - valid))
+    if not args.nostats:
+        stats.show()
+    if args.verify:
+        if not verify(args.dump,np.concatenate(collected) if collected else np.zeros(0,FRAME)):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
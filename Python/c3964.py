@@ -134,6 +134,112 @@ from stepchain import stepchain
 #   DLE           ->
 #
 #
+# Adaptive Zeiten für den 3964r Treiber
+# Die Zeiten SLP, SPZ, CWZ und BWZ sind für den ungünstigsten Fall ausgelegt, meistens wartet
+# der Treiber also länger als nötig. Im adaptiven Modus hat jede Zeit ihren eigenen Faktor und
+# ihre eigene Untergrenze. Die Untergrenze ist die Antwortzeit der Gegenseite, die von der Zeit
+# geschützt wird, mal Sicherheitsfaktor:
+#   SLP  (vor unserem DLE)            DLE->erstes Zeichen, Reaktion der Gegenseite auf unser DLE
+#   SPZ  (Pause nach dem Senden)      STX->DLE, Verbindungsaufbau
+#   CWZ  (nach Fehler beim Aufbau)    STX->DLE, Verbindungsaufbau
+#   BWZ  (nach Fehler beim Senden)    BCC->DLE, Quittung des Blocks
+# Nach einem erfolgreichen Schritt wird die zugehörige Zeit verkürzt, nach einem Fehler, den
+# eine zu kurze Zeit verursachen kann, wird sie wieder verlängert, höchstens bis zum festen Wert:
+#   SLP  kein Datenstrom nach unserem DLE (ZVZ-START), NAK der Gegenseite, wiederholter Block
+#   SPZ  Fehler beim Verbindungsaufbau, Initialisierungskonflikt (STX gegen STX)
+#   CWZ  Fehler beim Verbindungsaufbau, Initialisierungskonflikt (STX gegen STX)
+#   BWZ  Fehler bei der Quittung des Blocks
+# Ob unser DLE nach einem empfangenen Block angekommen ist, zeigt sich erst danach: wiederholt
+# die Gegenseite den Block oder sendet sie ein NAK, war SLP zu kurz, sonst war SLP lang genug.
+# Der Faktor nach einem Fehler gilt als Untergrenze der Zeit, die nur langsam wieder abklingt.
+#
+# Die Telegramme pro Minute hängen meistens von der Gegenseite ab (die Logamatic sendet nur bei
+# Änderungen), nicht von unseren Wartezeiten. Für den Bericht werden die Telegramme deshalb
+# auf die belegte Zeit der Leitung bezogen: vom ersten STX bis zum Ende des Austauschs
+# (inklusive SLP), und die Zeit, die ein Sendeauftrag durch SPZ, CWZ oder BWZ blockiert war.
+# Als Vergleich läuft jedes FIXED. Messfenster (auch das erste) mit den festen Zeiten, so
+# werden beide Varianten unter vergleichbarer Last gemessen.
+class adaptivetiming:
+    MARGIN   = 2.0    # Sicherheitsfaktor auf die gemessene Antwortzeit
+    SHRINK   = 0.9    # Faktor für eine Zeit nach einem erfolgreichen Schritt
+    GROW     = 2.0    # Faktor für eine Zeit nach einem Fehler
+    MINFACTOR= 0.05   # Zeiten werden nie kürzer als 5% der festen Werte
+    DECAY    = 0.99   # Abklingen der gemessenen (maximalen) Antwortzeit pro Messung
+    REPORT   = 600.0  # Sekunden zwischen zwei Berichten
+    WINDOW   = 600.0  # Länge eines Messfensters in Sekunden
+    FIXED    = 6      # jedes 6. Messfenster läuft mit den festen Zeiten (Vergleichswert)
+    # Antwortzeit der Gegenseite, welche die jeweilige Zeit schützt
+    PROTECT  = {"SLP": "DLE", "SPZ": "STX", "CWZ": "STX", "BWZ": "BCC"}
+
+    def __init__ (self):
+        self.factor    = dict.fromkeys (self.PROTECT,1.0)   # aktueller Faktor je Zeit auf den festen Wert
+        self.limit     = dict.fromkeys (self.PROTECT,self.MINFACTOR) # Untergrenze je Faktor, aus den Fehlern gelernt
+        self.response  = dict.fromkeys (("STX","BCC","DLE"),0.0) # gleitendes Maximum je Antwortzeit der Gegenseite
+        self.telegrams = 0          # erfolgreiche Telegramme
+        self.errors    = 0          # Fehler
+        self.saved     = 0.0        # tatsächlich eingesparte Wartezeit (Schlafen, blockiertes Senden)
+        self.count     = {False: 0, True: 0}     # Telegramme mit festen (False) und adaptiven (True) Zeiten
+        self.busy      = {False: 0.0, True: 0.0} # belegte Zeit der Leitung mit festen und adaptiven Zeiten
+        self.start     = t.time ()
+        self.lastreport= t.time ()
+
+    # Werden die Zeiten angepasst, oder läuft ein Messfenster mit festen Zeiten?
+    def adapting (self):
+        return int ((t.time ()-self.start)/self.WINDOW) % self.FIXED != 0
+
+    # Ein Telegramm wurde erfolgreich gesendet oder empfangen
+    def telegram (self):
+        self.telegrams +=1
+        self.count [self.adapting ()] +=1
+
+    # Die Leitung war sec Sekunden belegt
+    def linebusy (self,sec):
+        self.busy [self.adapting ()] += sec
+
+    # Antwortzeit name (STX, BCC, DLE) der Gegenseite merken
+    def measure (self,name,sec):
+        self.response [name]= max (sec,self.response [name]*self.DECAY)
+
+    # Die Zeiten names waren lang genug
+    def success (self,*names):
+        if not self.adapting ():
+            return
+        for name in names:
+            self.limit [name]= max (self.MINFACTOR,self.limit [name]*self.DECAY)
+            self.factor [name]= max (self.limit [name],self.factor [name]*self.SHRINK)
+
+    # Fehler, die Zeiten names waren eventuell zu kurz
+    def error (self,*names):
+        self.errors +=1
+        if not self.adapting ():
+            return
+        for name in names:
+            self.factor [name]= min (1.0,self.factor [name]*self.GROW)
+            self.limit [name]= self.factor [name]
+
+    # Liefert die aktuell zu verwendende Zeit name für den festen Wert sec
+    def delay (self,name,sec):
+        if not self.adapting ():
+            return sec
+        return min (sec,max (sec*self.factor [name],self.MARGIN*self.response [self.PROTECT [name]]))
+
+    # Ist es Zeit für den nächsten Bericht?
+    def reportdue (self):
+        if t.time ()-self.lastreport < self.REPORT:
+            return False
+        self.lastreport= t.time ()
+        return True
+
+    # Telegramme pro Minute belegter Leitung mit adaptiven und mit festen Zeiten
+    def report (self):
+        tpm= self.count [True]/self.busy [True]*60 if self.busy [True] else 0.0
+        tpm_fix= self.count [False]/self.busy [False]*60 if self.busy [False] else 0.0
+        return {"telegrams": self.telegrams, "errors": self.errors, "factor": dict (self.factor),
+                "response": dict (self.response), "saved": self.saved, "adapting": self.adapting (),
+                "busy": self.busy [True], "busy_fixed": self.busy [False],
+                "tpm": tpm, "tpm_fixed": tpm_fix, "gain": (tpm/tpm_fix-1)*100 if tpm and tpm_fix else 0.0}
+#
+#
 # Klassendifinition für den 3964r Treiber
 # Der Treiber bedient eine Schnittstelle, welche definiert werden muss
 class Dust3964r (stepchain,Serial):
@@ -158,8 +264,11 @@ class Dust3964r (stepchain,Serial):
     HIPRIO      = True    # hohe Priorität
     M3964       = False   # Treiber läuft als 3964 ohne BCC Blocksumme
     M3964R      = True    # Treiber läuft als 3964r mit BCC Blocksumme
+    Adaptiv     = None    # Adaptive Zeiten (adaptivetiming), None = feste Zeiten
+    AckTelegram = None    # Zuletzt quittierter Block (adaptive Zeiten)
+    BusySince   = None    # Beginn des laufenden Austauschs (adaptive Zeiten)
  
-    def __init__ (self,port=None,baudrate=9600,QVZ=2.0,ZVZ=0.22,BWZ=4.0,CWZ = 3.0,SPZ=0.5,SLP= 1.4,MAXSEND=6,MAXCONNECT=6,PRIO=HIPRIO, MODE=M3964R):
+    def __init__ (self,port=None,baudrate=9600,QVZ=2.0,ZVZ=0.22,BWZ=4.0,CWZ = 3.0,SPZ=0.5,SLP= 1.4,MAXSEND=6,MAXCONNECT=6,PRIO=HIPRIO, MODE=M3964R, ADAPTIV=False):
         # Initialisierung der Schrittkettenklasse
         stepchain.__init__ (self)
         # Initialisierung der SchnrittstellenKlasse
@@ -176,9 +285,17 @@ class Dust3964r (stepchain,Serial):
         self.connectERR= 0          # Verbindungsaufbau Fehler auf 0
         self.RUN       = False      # Treiber in Stop
         self.SendAtTime= 0          # Erlaube Senden ab dem Zeitpunkt
+        self.SendAtTimeFix= 0       # Zeitpunkt mit festen Zeiten (Statistik der adaptiven Zeiten)
+        self.AckTelegram= None      # Zuletzt quittierter Block, solange die Quittung nicht bestätigt ist
+        self.BusySince = None       # Beginn des laufenden Austauschs auf der Leitung
+        self.IdleSince = 0          # Ende des letzten Austauschs
+        self.JobSince  = 0          # Seit wann der aktuelle Sendeauftrag wartet
+        self.SendDelayStart= 0      # Beginn der laufenden Sendeverzögerung
+        self.AckTime   = 0          # Zeitpunkt dieser Quittung
         self.MODE      = MODE       # Treibermodus einstellen (Serienmäßig nach dem Start: 3964r mit Blocksumme
         self.CFG_PRIO  = PRIO       # Modus einstellen
         self.telegrammOut= []       # Ausgangspuffer ist leer
+        self.Adaptiv   = adaptivetiming () if ADAPTIV else None # Adaptive Zeiten ein/aus
         self.RS232.flushOutput ()   # puffer tillen
         self.RS232.flushInput ()
         self.RS232.write (self.NAK) # auf der schnittstelle mal blind am anfang ein NAK raushauen
@@ -257,7 +374,104 @@ class Dust3964r (stepchain,Serial):
  
     # eine Verzögerungszeit für das nächste Senden wird definiert
     def SetSendDelay (self,sec):
-        self.SendAtTime= t.time ()+sec
+        self.SendDelayStart= t.time ()
+        self.SendAtTime= self.SendDelayStart+sec
+        self.SendAtTimeFix= self.SendAtTime
+
+    # Liefert die zu verwendende Zeit für SLP, SPZ, CWZ oder BWZ (name)
+    # Mit festen Zeiten der eingestellte Wert, im adaptiven Modus die gelernte Zeit
+    def Delay (self,name):
+        if self.Adaptiv is None:
+            return getattr (self,name)
+        return self.Adaptiv.delay (name,getattr (self,name))
+
+    # Verzögerung für das nächste Senden um die Zeit name (SPZ, CWZ oder BWZ)
+    # Der Zeitpunkt mit der festen Zeit wird für die Statistik gemerkt
+    def SendDelay (self,name):
+        self.SetSendDelay (self.Delay (name))
+        self.SendAtTimeFix= t.time ()+getattr (self,name)
+
+    # Schlafen für die Zeit name (SLP)
+    def Sleep (self,name):
+        sec= self.Delay (name)
+        if self.Adaptiv is not None:
+            self.Adaptiv.saved += getattr (self,name)-sec
+        t.sleep (sec)
+
+    # Wir beginnen zu senden: mit festen Zeiten hätte der Job eventuell noch warten müssen
+    # Die Zeit, die der Job durch die Sendeverzögerung blockiert war, zählt als belegte Leitung.
+    def TimingSend (self):
+        if self.Adaptiv is not None:
+            jetzt= t.time ()
+            self.Adaptiv.saved += max (0.0,self.SendAtTimeFix-jetzt)
+            self.Adaptiv.linebusy (max (0.0,min (jetzt,self.SendAtTime)-max (self.JobSince,self.SendDelayStart,self.IdleSince)))
+            self.TimingBusy ()
+
+    # Auf der Leitung beginnt ein Austausch
+    def TimingBusy (self):
+        if self.Adaptiv is not None and self.BusySince is None:
+            self.BusySince= t.time ()
+
+    # Der Austausch ist beendet (zurück in Schritt 0)
+    def TimingIdle (self):
+        if self.BusySince is not None:
+            self.IdleSince= t.time ()
+            self.Adaptiv.linebusy (self.IdleSince-self.BusySince)
+            self.BusySince= None
+
+    # Die Gegenseite hat geantwortet: die Dauer im aktuellen Schritt ist ihre Antwortzeit name
+    def PeerResponse (self,name):
+        if self.Adaptiv is not None:
+            self.Adaptiv.measure (name,self.schrittDauer ())
+
+    # Die Zeiten names waren lang genug
+    def TimingSuccess (self,*names):
+        if self.Adaptiv is not None:
+            self.Adaptiv.success (*names)
+
+    # Ein Telegramm wurde erfolgreich gesendet oder empfangen
+    def TimingTelegram (self):
+        if self.Adaptiv is not None:
+            self.Adaptiv.telegram ()
+            if self.CFG_PRINT and self.Adaptiv.reportdue ():
+                r= self.Adaptiv.report ()
+                print ("Adaptive Zeiten: %d Telegramme, %d Fehler, Faktoren %s, Antwortzeiten %s, eingespart %.1fs, "
+                       "%.1f Telegramme/min belegter Leitung, mit festen Zeiten %.1f (%+.1f%%)" %
+                       (r ["telegrams"],r ["errors"]," ".join ("%s %.2f" % x for x in r ["factor"].items ()),
+                        " ".join ("%s %.3fs" % x for x in r ["response"].items ()),r ["saved"],r ["tpm"],r ["tpm_fixed"],r ["gain"]))
+
+    # Wir haben den Block telegram mit DLE quittiert, ob das DLE ankam, zeigt sich erst später
+    def TimingAck (self,telegram):
+        if self.Adaptiv is not None:
+            self.AckTelegram= telegram
+            self.AckTime= t.time ()
+
+    # Prüft die Quittung des letzten Blocks, telegram ist der nächste empfangene Block (oder None)
+    # Derselbe Block innerhalb der Wiederholzeit der Gegenseite (QVZ+BWZ): SLP war zu kurz.
+    # Ein anderer Block, oder keine Wiederholung innerhalb dieser Zeit: SLP war lang genug.
+    def TimingAckCheck (self,telegram=None):
+        if self.AckTelegram is None:
+            return
+        wiederholzeit= t.time ()-self.AckTime < self.QVZ+self.BWZ
+        if telegram is not None and telegram==self.AckTelegram and wiederholzeit:
+            self.TimingError ("SLP")
+        elif telegram is not None or not wiederholzeit:
+            self.TimingSuccess ("SLP")
+        else:
+            return
+        self.AckTelegram= None
+
+    # Fehler in der Kommunikation, die Zeiten names waren eventuell zu kurz
+    # Muss vor Delay aufgerufen werden, damit die verlängerte Zeit schon gilt
+    def TimingError (self,*names):
+        if self.Adaptiv is not None:
+            self.Adaptiv.error (*names)
+
+    # Bericht der adaptiven Zeiten (dictionary), None mit festen Zeiten
+    def TimingReport (self):
+        if self.Adaptiv is None:
+            return None
+        return self.Adaptiv.report ()
  
     # Read Success wird aufgerufen, wenn ein Telegramm erfolgreich eingelesen wurde
     # Virtuelle Routine, muss überladen werden vom child    
@@ -313,30 +527,43 @@ class Dust3964r (stepchain,Serial):
                     print(t.strftime("%H:%M:%S")+"."+ "%6.6d"% datetime.now().microsecond + ": Telegramm verworfen nach " , self.MAXSEND , " Fehlversuchen")
                 self.sendERR=0
                 self.connectERR=0
+            self.TimingIdle ()
         if (self.sendbuff==b"") and self.isJob ():
             job= self.getJob ()
             if not (job is None):
                 self.sendbuff=job
+                self.JobSince=t.time ()
         self.SEND_EN= (len(self.sendbuff)!=0) and (t.time ()>self.SendAtTime)        
+        if self.AckTelegram is not None:
+            self.TimingAckCheck ()
         if self.RS232.inWaiting () and self.RealRun:
             # Es ist ein Zeichen im Empfangspuffer
             # An dieser Stelle kann und darf es höchstens das Zeichen STX sein
             char= self.RS232.read ()
+            self.TimingBusy ()
             if char != self.STX:
                 # Es war kein STX, das ist auf jedenfall mal ein Fehler also: NAK senden
                 if self.CFG_PRINT:
                     print(t.strftime("%H:%M:%S")+"."+ "%6.6d"% datetime.now().microsecond + ":[RX]"+ "%3.2X"% ord (char) + "r 15s [NAK: STX-START]")                  
+                if char==self.NAK:
+                    # NAK der Gegenseite: unser DLE kam eventuell zu früh
+                    self.TimingError ("SLP")
+                    self.AckTelegram= None
+                else:
+                    self.TimingError ()
                 self.errNAK ()
             else: # Es war ein STX
                 if not self.CFG_PRIO or not self.SEND_EN: # Treiber hat niedrige PRIO oder nix zum senden
                     if self.CFG_PRINT:
                         print(t.strftime("%H:%M:%S")+"."+ "%6.6d"% datetime.now().microsecond + ":[RX] 02r",end="")
-                    t.sleep (self.SLP) # Für die erlaubte Antwortzeit legt sich der Prozess schlafen    
+                    self.Sleep ("SLP") # Für die erlaubte Antwortzeit legt sich der Prozess schlafen    
                     self.setnewstep (4) # Verbindungsaufbau 3964r läuft nun ready to receive
                 elif self.SEND_EN:
                     if self.CFG_PRINT:
                         print(t.strftime("%H:%M:%S")+"."+ "%6.6d"% datetime.now().microsecond + ":[TX] 02r 02s",end="")
+                    self.TimingError ("SPZ","CWZ") # Initialisierungskonflikt
                     self.RS232.flushOutput ()
+                    self.TimingSend ()
                     self.RS232.write (self.STX)
                     self.setnewstep (1) # verbindungsaufbau mit Konflikt: wir wollen Senden mit Hiprio
         else: # Es gibt kein Zeichen im Empfangspuffer
@@ -345,6 +572,7 @@ class Dust3964r (stepchain,Serial):
                     print(t.strftime("%H:%M:%S")+"."+ "%6.6d"% datetime.now().microsecond + ":[TX] 02s",end="")
                 self.RS232.flushInput ()    
                 self.RS232.flushOutput ()
+                self.TimingSend ()
                 self.RS232.write (self.STX)
                 self.setnewstep (3) # Verbindungsaufbau von uns kommt
  
@@ -357,7 +585,8 @@ class Dust3964r (stepchain,Serial):
             if self.CFG_PRINT:
                 print (" 15s [NAK: QVZ-START]")
             self.connectERR +=1 # Verbindungsaufbaufehler um 1 erhöhen
-            self.SetSendDelay (self.CWZ)
+            self.TimingError ("CWZ","SPZ")
+            self.SendDelay ("CWZ")
             self.errNAK ()
         elif self.RS232.inWaiting ():
             # Zeichen wurde eingelesen, es muss ein DLE sein
@@ -367,9 +596,12 @@ class Dust3964r (stepchain,Serial):
                 if self.CFG_PRINT:
                     print ("%3.2X"% ord (c) + "r 15s [NAK: DLE-START]")
                 self.connectERR +=1 # Verbindungsaufbaufehler um 1 erhöhen
-                self.SetSendDelay (self.CWZ)
+                self.TimingError ("CWZ","SPZ")
+                self.SendDelay ("CWZ")
                 self.errNAK ()
             else: # es war ein DLE, senden ausführen
+                self.PeerResponse ("STX")
+                self.TimingSuccess ("CWZ","SPZ")
                 self.sendstream (self.sendbuff)
                 self.setnewstep (2)
  
@@ -381,7 +613,8 @@ class Dust3964r (stepchain,Serial):
             if self.CFG_PRINT:
                 print (" 15s [NAK: QVZ-BCC]")
             self.sendERR +=1 # sendefehler um 1 erhöhen
-            self.SetSendDelay (self.BWZ)
+            self.TimingError ("BWZ")
+            self.SendDelay ("BWZ")
             self.errNAK ()
         elif self.RS232.inWaiting ():
             # Zeichen wurde eingelesen, es muss ein DLE sein
@@ -391,14 +624,18 @@ class Dust3964r (stepchain,Serial):
                 if self.CFG_PRINT:
                     print ("%3.2X"% ord (c) + "r 15s [NAK: DLE-BCC]")
                 self.sendERR +=1 # Verbindungsaufbaufehler um 1 erhöhen
-                self.SetSendDelay (self.BWZ)
+                self.TimingError ("BWZ")
+                self.SendDelay ("BWZ")
                 self.errNAK ()
             else: # es war ein DLE, Telegramm wurde erfolgreich versendet
                 if self.CFG_PRINT:
                     print (" 10r [OK]")
+                self.PeerResponse ("BCC")
+                self.TimingSuccess ("BWZ")
+                self.TimingTelegram ()
                 self.WriteSuccess (self.sendbuff) # Virtuelle Routine
                 self.sendbuff=b"" # Sendepuffer löschen, das telegramm austragen
-                self.SetSendDelay (self.SPZ)
+                self.SendDelay ("SPZ")
                 self.setnewstep (0)
  
     # Schritt 3: Verbindungsaufbau von uns angestossen, wir wollen senden
@@ -411,13 +648,16 @@ class Dust3964r (stepchain,Serial):
             if self.CFG_PRINT:
                 print (" 15s [NAK: QVZ-DLE START]")
             self.sendERR +=1 # sendefehler um 1 erhöhen
-            self.SetSendDelay (self.CWZ)
+            self.TimingError ("CWZ","SPZ")
+            self.SendDelay ("CWZ")
             self.errNAK ()
         elif self.RS232.inWaiting ():
             c= self.RS232.read ()
             if c== self.DLE:
                 # Das eingelesene Zeichen ist ein DLE
                 # wunderbar, alles, ok, wir können senden
+                self.PeerResponse ("STX")
+                self.TimingSuccess ("CWZ","SPZ")
                 self.sendstream (self.sendbuff)
                 # Nach dem Senden muss mit DLE vom empfänger bestätigt werden
                 self.setnewstep (2)
@@ -443,12 +683,14 @@ class Dust3964r (stepchain,Serial):
                     if self.CFG_PRINT:
                         print (" 02r 15s [NAK: STX-STX PRIO]")
                     self.connectERR +=1 # connectfehler um 1 erhöhen
+                    self.TimingError ("SPZ","CWZ")
                     self.SetSendDelay (0)
                     self.errNAK ()
             else:
                 print ("%3.2X"% ord (c) + "r 15s [NAK: DLE-START]")
                 self.connectERR +=1 # Verbindungsaufbaufehler um 1 erhöhen             
-                self.SetSendDelay (self.CWZ)                
+                self.TimingError ("CWZ","SPZ")
+                self.SendDelay ("CWZ")                
                 self.errNAK ()
       
  
@@ -467,9 +709,11 @@ class Dust3964r (stepchain,Serial):
             # Zeichenverzugszeit ist abgelaufen NAK fehler
             if self.CFG_PRINT:
                 print (" 15s [NAK: ZVZ-START]")            
+            self.TimingError ("SLP") # unser DLE kam eventuell zu früh
             self.errNAK ()  
         elif self.RS232.inWaiting ():
             # Zeichen innerhalb der Zeit im Puffer, alles ist gut
+            self.PeerResponse ("DLE")
             self.setnewstep (5)  
  
     # Schritt 5: Empfangen Datenstream
@@ -486,6 +730,7 @@ class Dust3964r (stepchain,Serial):
         if t.time ()-self.starttime > self.ZVZ:
             if self.CFG_PRINT:
                 print (" 15s [NAK: ERR-ZVZ]")
+            self.TimingError ()
             self.errNAK ()
         else:    
             #solange wie zeichen im puffer oder EndeStream nicht erkannt    
@@ -502,15 +747,19 @@ class Dust3964r (stepchain,Serial):
                         # Fehler beim Zerlegen vom Inframe oder Checksum fehler
                         if self.CFG_PRINT:
                             print (" 15s [NAK: ERR-BCC]")
+                        self.TimingError ()
                         self.errNAK ()
                     else:    
                         if self.CFG_PRINT:
                             print (" 10s [DLE: OK]")
-                        self.ReadSuccess (rec)                               
+                        self.ReadSuccess (rec)
+                        self.TimingAckCheck (rec)
+                        self.TimingTelegram ()                               
                         self.RS232.flushInput ()
                         self.RS232.flushOutput ()                      
-                        t.sleep (self.SLP) # Für die erlaubte Quittungsverzugszeit legt sich der Prozess mal schlafen
+                        self.Sleep ("SLP") # Für die erlaubte Quittungsverzugszeit legt sich der Prozess mal schlafen
                         self.RS232.write (self.DLE)
+                        self.TimingAck (rec)
                     self.setnewstep (0)    
                     break
                 elif (c==self.DLE):
@@ -20,28 +20,33 @@
 # in a log database table for pontential future analysis.
 
 
-from c3964r import Dust3964r
+from c3964 import Dust3964r
+from ringbuffer import shmring
+import profiling
 import threading
+import multiprocessing
+import gc
+import time as t
 import pymysql
 
+# Adjust name of the serial device and the baud rate if necessary.
+SERIAL_PORT = '/dev/ttyAMA0'
+BAUDRATE = 2400
+
 ende = False
 
-class logamatic2107 (Dust3964r,threading.Thread):
 
+# Decoding of data telegrams and persistence in the database
+# Used by logamatic2107 directly and by the consumer process of the split mode.
+class logamaticdecoder:
 
-    # Constructor
-    def __init__ (self):
-        # Initiate class for reading the 3964 data protocol.
-        # Adjust name of the serial device in the following line if necessary.
-        Dust3964r.__init__ (self,port='/dev/ttyAMA0',baudrate=2400)
-        threading.Thread.__init__ (self)
-        print("Starting initial query of Logamatic.")
-        Dust3964r.newJob(self,b"\xEE\x00\x00")
+    # Connect to database - adjust credentials as needed.
+    def ConnectDB (self):
+        return pymysql.connect(host="SERVER",user="USER",password="PASSWORD",database="DATABASE")
 
     # Log any given telegram to database
     def LogToDB (self,telegram):
-        # Connect to database - adjust credentials as needed.
-        db = pymysql.connect("SERVER","USER","PASSWORD","DATABASE" )
+        db = self.ConnectDB()
         cursor = db.cursor()
 
         sql = "INSERT INTO rawlog (length, telegram_byte1, telegram_byte2, telegram_byte3, telegram_byte4, telegram_byte5, telegram_byte6, telegram_byte7, telegram_byte8, telegram_byte9, telegram_byte10) VALUES ("
@@ -74,8 +79,7 @@ class logamatic2107 (Dust3964r,threading.Thread):
 
     # Write state to database
     def StateToDB (self,typeOfValue,value):
-        # Connect to database - adjust credentials as needed.
-        db = pymysql.connect("SERVER","USER","PASSWORD","DATABASE" )
+        db = self.ConnectDB()
         cursor = db.cursor()
         sql = "INSERT INTO current_state (id, " + typeOfValue + ") VALUES (1, " + str(value) + ") ON DUPLICATE KEY UPDATE " + typeOfValue + " = " + str(value)
         try:
@@ -86,14 +90,8 @@ class logamatic2107 (Dust3964r,threading.Thread):
         db.close()
 
 
-    # Main procedure for thread
-    def run (self):
-        global ende
-        while not ende:
-            self.running ()
-
-    # Eventhandler that is called from the 3964 unit if a data telegram is received successfully
-    def ReadSuccess (self,telegram):
+    # Decode a data telegram and write its content to the database
+    def Decode (self,telegram):
         if len(telegram)==3:
             # Data telegram found
             ID= telegram [0:2]
@@ -196,3 +194,153 @@ class logamatic2107 (Dust3964r,threading.Thread):
             self.LogToDB(telegram)
 
 
+class logamatic2107 (Dust3964r,logamaticdecoder,threading.Thread):
+
+
+    # Constructor
+    # With adaptive=True, the 3964 unit learns the response times of the Logamatic
+    # and shortens its waiting times accordingly.
+    def __init__ (self,adaptive=False):
+        # Initiate class for reading the 3964 data protocol.
+        Dust3964r.__init__ (self,port=SERIAL_PORT,baudrate=BAUDRATE,ADAPTIV=adaptive)
+        threading.Thread.__init__ (self)
+        print("Starting initial query of Logamatic.")
+        Dust3964r.newJob(self,b"\xEE\x00\x00")
+
+    # Main procedure for thread
+    def run (self):
+        global ende
+        while not ende:
+            self.running ()
+
+    # Eventhandler that is called from the 3964 unit if a data telegram is received successfully
+    def ReadSuccess (self,telegram):
+        self.Decode(telegram)
+
+
+# Split mode
+# ~~~~~~~~~~
+# The 3964R timing (QVZ 2 s, ZVZ 220 ms) must not suffer from slow database calls or
+# garbage collection pauses. In split mode, the serial process only does the 3964R
+# framing and acknowledges and pushes every received telegram into a shared memory
+# ring buffer. A separate consumer process takes the telegrams from the ring,
+# decodes them and writes them to the database.
+
+# Serial process: 3964R protocol only, no database access
+class logamatic2107serial (Dust3964r):
+
+
+    WATCHDOG = 1.0       # Interval for checking the consumer process
+    RESPAWNS = 3         # Consumer restarts allowed within RESPAWNTIME
+    RESPAWNTIME = 600.0
+
+    # Constructor
+    # startconsumer is called to start the consumer process, it returns the process.
+    def __init__ (self,ring,startconsumer,adaptive=False):
+        self.ring = ring
+        self.startconsumer = startconsumer
+        self.worker = startconsumer()
+        Dust3964r.__init__ (self,port=SERIAL_PORT,baudrate=BAUDRATE,ADAPTIV=adaptive)
+        self.respawns = []
+        self.nextcheck = t.monotonic() + self.WATCHDOG
+        print("Starting initial query of Logamatic.")
+        Dust3964r.newJob(self,b"\xEE\x00\x00")
+
+    # Main procedure of the serial process
+    def run (self):
+        global ende
+        # Everything allocated so far lives for the whole runtime, keep it out of
+        # the garbage collector's way.
+        gc.freeze()
+        while not ende:
+            self.running ()
+            if t.monotonic() >= self.nextcheck:
+                self.nextcheck = t.monotonic() + self.WATCHDOG
+                self.watchdog()
+
+    # Restart the consumer process if it has died. If it keeps dying, the daemon
+    # is terminated, so it can be restarted as a whole (e.g. by systemd).
+    def watchdog (self):
+        if self.worker.is_alive():
+            return
+        now = t.monotonic()
+        self.respawns = [since for since in self.respawns if now - since < self.RESPAWNTIME]
+        if len(self.respawns) >= self.RESPAWNS:
+            raise SystemExit("Consumer process died " + str(len(self.respawns) + 1) + " times, exit code " + str(self.worker.exitcode))
+        self.respawns.append(now)
+        print("Consumer process died, exit code", self.worker.exitcode, "- restarting")
+        self.worker = self.startconsumer()
+
+    # Eventhandler that is called from the 3964 unit if a data telegram is received successfully
+    # Only hands over the telegram, the acknowledge must not be delayed.
+    def ReadSuccess (self,telegram):
+        if not self.ring.put(telegram):
+            print("Ring buffer full, telegram dropped:", telegram.hex())
+
+
+# Consumer process: decoding and database access
+class logamatic2107consumer (logamaticdecoder):
+
+    IDLE = 0.05          # Wait time if the ring is empty
+    STATS = 600.0        # Interval for printing the ring statistics
+
+    # Constructor
+    def __init__ (self,ring):
+        self.ring = ring
+        self.overflows = 0
+        self.failed = 0
+        self.nextstats = t.monotonic() + self.STATS
+
+    # Main procedure of the consumer process
+    def run (self):
+        global ende
+        while not ende:
+            self.running ()
+
+    # One cycle of the consumer: take a telegram from the ring and decode it
+    # A telegram which cannot be decoded or written (e.g. database not available)
+    # is dropped, the consumer process keeps running.
+    def running (self):
+        if t.monotonic() >= self.nextstats:
+            self.nextstats = t.monotonic() + self.STATS
+            print("Ring buffer:", self.ring.stats(), "failed:", self.failed)
+        telegram = self.ring.get()
+        if telegram is None:
+            t.sleep(self.IDLE)
+            return
+        try:
+            self.Decode(telegram)
+        except Exception as e:
+            self.failed += 1
+            print("Telegram", telegram.hex(), "dropped:", repr(e))
+        if self.ring.overflows() != self.overflows:
+            self.overflows = self.ring.overflows()
+            print("Ring buffer overflow:", self.ring.stats())
+
+
+# Entry point of the consumer process: attaches to the ring created by the serial process
+def consumer (name,sampling=False):
+    ring = shmring(name)
+    try:
+        worker = logamatic2107consumer(ring)
+        profiling.install(worker,sampling)
+        worker.run()
+    finally:
+        ring.close()
+
+
+# Start the daemon in split mode: consumer in a child process, serial part in this process
+# Both processes can be profiled via signals, see profiling.py.
+def runsplit (sampling=False,adaptive=False):
+    ring = shmring()
+    def startconsumer ():
+        worker = multiprocessing.Process(target=consumer,args=(ring.name,sampling),daemon=True)
+        worker.start()
+        print("Consumer process started, PID", worker.pid)
+        return worker
+    try:
+        serial = logamatic2107serial(ring,startconsumer,adaptive)
+        profiling.install(serial,sampling)
+        serial.run()
+    finally:
+        ring.close()
@@ -0,0 +1,275 @@
+#!usr/bin/python3 -u
+# -*-coding:Utf-8 -*
+#
+# Class profiler
+# ~~~~~~~~~~~~~~
+#
+# Runtime profiling of the step chain and the callbacks, switchable while the daemon
+# is running:
+#   - histograms of the wall and CPU time per step (schritt_N), per call of the step
+#     chain (running) and per callback (ReadSuccess, Decode, StateToDB, ...)
+#   - time-boxed cProfile run in the thread executing the step chain
+#   - time-boxed sampling profiler for that thread, the result is written in the
+#     "folded" format used by flamegraph tools
+#
+# While profiling is switched off, no method of the target is wrapped, so there is no
+# overhead at all. Switching on wraps the methods of the target instance; switching
+# off removes the wrappers again.
+#
+# install() connects the profiler to signals:
+#   SIGUSR1   histograms on/off, the report is printed and written when switched off
+#   SIGUSR2   time-boxed cProfile run (or sampling profiler, see install)
+# The signal handlers only set request flags. A watcher thread connects the profiler
+# to the loop of the target when something was requested, and the requests are
+# carried out there, between two cycles of the step chain.
+#
+# Example:
+#   kill -USR1 <pid>    ... wait ...    kill -USR1 <pid>
+#
+# License: CC-BY-SA 3.0
+
+import cProfile
+import collections
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time as t
+
+# Methods measured by the histograms, if the target has them
+METHODS = ("schritt_0","schritt_1","schritt_2","schritt_3","schritt_4","schritt_5",
+           "ReadSuccess","WriteSuccess","WriteFail","Decode","StateToDB","LogToDB")
+
+# Method called once per cycle of the main loop of the target
+LOOP = "running"
+
+
+# Histogram of durations with power of two buckets in microseconds
+class histogram:
+
+    def __init__ (self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = collections.Counter()
+
+    def add (self,seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        self.buckets[int(seconds*1000000).bit_length()] += 1
+
+    # Buckets as text, e.g. "<1ms:12 <2ms:3"
+    def text (self):
+        parts = []
+        for bucket in sorted(self.buckets):
+            limit = (1 << bucket)/1000000
+            label = "<%gms" % (limit*1000) if limit < 1 else "<%gs" % limit
+            parts.append("%s:%d" % (label,self.buckets[bucket]))
+        return " ".join(parts)
+
+
+class profiler:
+
+    POLL = 0.5          # Interval of the watcher thread checking for requests
+
+    # Constructor
+    # target is the object running the step chain (e.g. logamatic2107), directory is
+    # where the profile files are written.
+    def __init__ (self,target,directory=None):
+        self.target = target
+        self.directory = directory or tempfile.gettempdir()
+        self.enabled = False
+        self.toggle_request = False
+        self.lock = threading.Lock()    # hook/unhook from the watcher and the step chain
+        self.wrapped = []
+        self.wall = collections.defaultdict(histogram)
+        self.cpu = collections.defaultdict(histogram)
+        self.since = None
+        self.ident = None               # thread running the step chain
+        self.cprofile = None
+        self.cprofile_request = 0
+        self.cprofile_until = 0
+        self.sample_request = None
+
+    # Switch histograms on
+    # Like disable, only to be called in the thread of the step chain.
+    def enable (self):
+        if self.enabled:
+            return
+        self.wall.clear()
+        self.cpu.clear()
+        self.since = t.time()
+        for name in METHODS:
+            if hasattr(self.target,name):
+                self.wrapped.append((name,self.target.__dict__.get(name)))
+                setattr(self.target,name,self.measure(name,getattr(self.target,name)))
+        self.enabled = True
+        self.hook()
+        print("Profiling enabled")
+
+    # Switch histograms off, returns the report
+    def disable (self):
+        if not self.enabled:
+            return ""
+        self.enabled = False
+        # Methods set on the instance itself are restored, wrappers of class methods removed
+        for name, original in self.wrapped:
+            if original is None:
+                delattr(self.target,name)
+            else:
+                setattr(self.target,name,original)
+        self.wrapped = []
+        self.unhook()
+        report = self.report()
+        # The file is written outside of the step chain
+        threading.Thread(target=self.write,args=(report,),daemon=True).start()
+        return report
+
+    def write (self,report):
+        path = self.filename("txt")
+        with open(path,"w") as f:
+            f.write(report)
+        print(report)
+        print("Profiling disabled, report written to", path)
+
+    # The following requests only set flags, so they can be called from signal
+    # handlers. They are carried out with the next cycle of the step chain.
+
+    # Switch histograms on or off
+    def toggle (self):
+        self.toggle_request = True
+
+    # Time-boxed cProfile run in the thread of the step chain
+    def profile (self,seconds=30):
+        if self.cprofile is None:
+            self.cprofile_request = seconds
+
+    # Time-boxed sampling profiler for the thread of the step chain
+    def sample (self,seconds=30,interval=0.005):
+        if self.sample_request is None:
+            self.sample_request = (seconds,interval)
+
+    def requested (self):
+        return self.toggle_request or self.cprofile_request or self.sample_request not in (None,"running")
+
+    # Watcher thread: connects the loop of the target when something was requested
+    def watch (self):
+        while True:
+            if self.requested():
+                self.hook()
+            t.sleep(self.POLL)
+
+    # Histograms as text
+    def report (self):
+        elapsed = t.time() - self.since if self.since else 0.0
+        lines = ["Profile of %.1f s, wall/CPU time per call in ms (inclusive)" % elapsed,
+                 "%-14s %9s %9s %9s %9s %9s  %s" % ("","calls","wall avg","wall max","cpu avg","cpu max","wall histogram")]
+        for name in sorted(self.wall):
+            wall = self.wall[name]
+            cpu = self.cpu[name]
+            lines.append("%-14s %9d %9.3f %9.3f %9.3f %9.3f  %s" % (name,wall.count,wall.total/wall.count*1000,wall.maximum*1000,
+                         cpu.total/cpu.count*1000,cpu.maximum*1000,wall.text()))
+        return "\n".join(lines) + "\n"
+
+    # Wrapper measuring wall and CPU time of a method
+    def measure (self,name,method):
+        def wrapper (*args,**kwargs):
+            w = t.perf_counter()
+            c = t.thread_time()
+            try:
+                return method(*args,**kwargs)
+            finally:
+                self.cpu[name].add(t.thread_time() - c)
+                self.wall[name].add(t.perf_counter() - w)
+        return wrapper
+
+    # The loop method of the target is wrapped while anything is active, so the
+    # profilers can be started and stopped from within the thread of the step chain.
+    def hook (self):
+        with self.lock:
+            if LOOP in self.target.__dict__ or not hasattr(self.target,LOOP):
+                return
+            method = getattr(self.target,LOOP)
+            measured = self.measure(LOOP,method)
+            def wrapper ():
+                self.cycle()
+                if self.enabled:
+                    measured()
+                else:
+                    method()
+            setattr(self.target,LOOP,wrapper)
+
+    def unhook (self):
+        with self.lock:
+            if (not self.enabled and self.cprofile is None and not self.requested()
+                    and self.sample_request is None and LOOP in self.target.__dict__):
+                delattr(self.target,LOOP)
+
+    # Called before every cycle of the step chain, in its thread
+    def cycle (self):
+        self.ident = threading.get_ident()
+        if self.toggle_request:
+            self.toggle_request = False
+            if self.enabled:
+                self.disable()
+            else:
+                self.enable()
+        if self.cprofile_request:
+            print("cProfile started for", self.cprofile_request, "s")
+            self.cprofile = cProfile.Profile()
+            self.cprofile_until = t.monotonic() + self.cprofile_request
+            self.cprofile_request = 0
+            self.cprofile.enable()
+        elif self.cprofile is not None and t.monotonic() > self.cprofile_until:
+            self.cprofile.disable()
+            path = self.filename("prof")
+            self.cprofile.dump_stats(path)
+            self.cprofile = None
+            print("cProfile written to", path)
+        if self.sample_request is not None and self.sample_request != "running":
+            seconds, interval = self.sample_request
+            self.sample_request = "running"
+            print("Sampling profiler started for", seconds, "s")
+            threading.Thread(target=self.sampler,args=(self.ident,seconds,interval),daemon=True).start()
+        self.unhook()
+
+    # Sampling profiler, runs in its own thread
+    def sampler (self,ident,seconds,interval):
+        stacks = collections.Counter()
+        until = t.monotonic() + seconds
+        while t.monotonic() < until:
+            frame = sys._current_frames().get(ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s:%s" % (os.path.basename(code.co_filename),code.co_name))
+                frame = frame.f_back
+            if stack:
+                stacks[";".join(reversed(stack))] += 1
+            t.sleep(interval)
+        path = self.filename("folded")
+        with open(path,"w") as f:
+            for stack, count in stacks.most_common():
+                f.write("%s %d\n" % (stack,count))
+        self.sample_request = None
+        print("Sampling profile with", sum(stacks.values()), "samples written to", path)
+
+    def filename (self,extension):
+        return os.path.join(self.directory,"logamatic-%d-%s.%s" % (os.getpid(),t.strftime("%Y%m%d-%H%M%S"),extension))
+
+
+# Connect a profiler for target to the signals SIGUSR1 and SIGUSR2
+# Must be called from the main thread. With sampling=True, SIGUSR2 starts the
+# sampling profiler instead of cProfile.
+def install (target,sampling=False,seconds=30,directory=None):
+    p = profiler(target,directory)
+    threading.Thread(target=p.watch,daemon=True).start()
+    signal.signal(signal.SIGUSR1,lambda signum,frame: p.toggle())
+    if sampling:
+        signal.signal(signal.SIGUSR2,lambda signum,frame: p.sample(seconds))
+    else:
+        signal.signal(signal.SIGUSR2,lambda signum,frame: p.profile(seconds))
+    return p
@@ -0,0 +1,158 @@
+#!usr/bin/python3 -u
+# -*-coding:Utf-8 -*
+#
+# Class shmring
+# ~~~~~~~~~~~~~
+#
+# Lock-free single-producer/single-consumer ring buffer in shared memory
+#
+# License: CC-BY-SA 3.0
+#
+# The ring is used to hand over received telegrams from the serial process (which
+# only handles the 3964R framing and acknowledges) to the consumer process (which
+# decodes the telegrams and writes them to the database). The producer is the only
+# one writing the head index and the consumer is the only one writing the tail
+# index, so no lock is needed between the two processes.
+#
+# Layout of the shared memory block:
+#   word 0      head (number of telegrams written by the producer)
+#   word 1      overflows (telegrams dropped because the ring was full)
+#   word 2      oversize (telegrams dropped because they did not fit into a slot)
+#   word 3      number of slots
+#   word 16     tail (number of telegrams read by the consumer, own cache line)
+#   word 17     received (number of telegrams read, for the latency average)
+#   byte 72..95 latency last, maximum and sum in seconds (doubles, consumer side)
+#   byte 128..  slots
+#
+# Layout of a slot (SLOTSIZE bytes):
+#   byte 0..7   time the telegram was put into the ring (time.monotonic)
+#   byte 8..9   length of the telegram
+#   byte 12..15 sequence number (head+1), written last, checked by the consumer
+#   byte 16..   telegram
+
+
+import struct
+import time as t
+from multiprocessing import shared_memory
+
+HEADERSIZE = 128
+SLOTSIZE = 64
+SLOTHEADER = struct.Struct("=dH")
+MAXTELEGRAM = SLOTSIZE - 16
+
+W_HEAD = 0
+W_OVERFLOWS = 1
+W_OVERSIZE = 2
+W_SLOTS = 3
+W_TAIL = 16
+W_RECEIVED = 17
+
+# Indices of the latency doubles in the header
+D_LATENCY_LAST = 9
+D_LATENCY_MAX = 10
+D_LATENCY_SUM = 11
+
+MASK32 = 0xFFFFFFFF
+
+
+class shmring:
+
+    # Constructor
+    # If no name is given, a new shared memory block with the given number of slots
+    # is created (producer side). Otherwise the existing block is attached.
+    def __init__ (self,name=None,slots=256):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True,size=HEADERSIZE + slots*SLOTSIZE)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        # Aligned 32 bit accesses via a memoryview are single stores/loads, so
+        # the indices can never be read half-written by the other process.
+        self.words = self.shm.buf.cast("I")
+        # The latency statistics are written by the consumer only and are in the
+        # shared block too, so both processes can report them.
+        self.doubles = self.shm.buf[:HEADERSIZE].cast("d")
+        if self.owner:
+            self.words[W_HEAD] = 0
+            self.words[W_OVERFLOWS] = 0
+            self.words[W_OVERSIZE] = 0
+            self.words[W_SLOTS] = slots
+            self.words[W_TAIL] = 0
+            self.words[W_RECEIVED] = 0
+            self.doubles[D_LATENCY_LAST] = 0.0
+            self.doubles[D_LATENCY_MAX] = 0.0
+            self.doubles[D_LATENCY_SUM] = 0.0
+        self.slots = self.words[W_SLOTS]
+
+    # Put a telegram into the ring (producer side)
+    # Never blocks: if the ring is full, the telegram is dropped and counted.
+    # Returns True if the telegram was stored.
+    def put (self,telegram):
+        if len(telegram) > MAXTELEGRAM:
+            self.words[W_OVERSIZE] = (self.words[W_OVERSIZE] + 1) & MASK32
+            return False
+        head = self.words[W_HEAD]
+        if ((head - self.words[W_TAIL]) & MASK32) >= self.slots:
+            self.words[W_OVERFLOWS] = (self.words[W_OVERFLOWS] + 1) & MASK32
+            return False
+        offset = HEADERSIZE + (head % self.slots)*SLOTSIZE
+        SLOTHEADER.pack_into(self.shm.buf,offset,t.monotonic(),len(telegram))
+        self.shm.buf[offset+16:offset+16+len(telegram)] = telegram
+        # Sequence number and head are published last
+        self.words[(offset+12)//4] = (head + 1) & MASK32
+        self.words[W_HEAD] = (head + 1) & MASK32
+        return True
+
+    # Get the oldest telegram from the ring (consumer side)
+    # Returns None if the ring is empty.
+    def get (self):
+        tail = self.words[W_TAIL]
+        if tail == self.words[W_HEAD]:
+            return None
+        offset = HEADERSIZE + (tail % self.slots)*SLOTSIZE
+        if self.words[(offset+12)//4] != (tail + 1) & MASK32:
+            # Slot not yet completely visible, try again later
+            return None
+        stamp, length = SLOTHEADER.unpack_from(self.shm.buf,offset)
+        telegram = bytes(self.shm.buf[offset+16:offset+16+length])
+        self.words[W_TAIL] = (tail + 1) & MASK32
+        latency = t.monotonic() - stamp
+        self.words[W_RECEIVED] = (self.words[W_RECEIVED] + 1) & MASK32
+        self.doubles[D_LATENCY_LAST] = latency
+        self.doubles[D_LATENCY_SUM] += latency
+        if latency > self.doubles[D_LATENCY_MAX]:
+            self.doubles[D_LATENCY_MAX] = latency
+        return telegram
+
+    # Number of telegrams waiting in the ring
+    def pending (self):
+        return (self.words[W_HEAD] - self.words[W_TAIL]) & MASK32
+
+    # Number of telegrams dropped because the ring was full
+    def overflows (self):
+        return self.words[W_OVERFLOWS]
+
+    # Overflow and latency counters
+    # Can be called in both processes.
+    def stats (self):
+        received = self.words[W_RECEIVED]
+        return {
+            "slots": self.slots,
+            "pending": self.pending(),
+            "overflows": self.words[W_OVERFLOWS],
+            "oversize": self.words[W_OVERSIZE],
+            "received": received,
+            "latency_last": self.doubles[D_LATENCY_LAST],
+            "latency_max": self.doubles[D_LATENCY_MAX],
+            "latency_avg": self.doubles[D_LATENCY_SUM]/received if received else 0.0,
+        }
+
+    # Release the shared memory (the creating side also removes the block)
+    def close (self):
+        self.doubles.release()
+        self.words.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()